@@ -21,9 +21,36 @@ dnsblk_log = rootpath + "logs/dnsblchk_"
 # Path and the name of the error file (stored as Text)
 dnsblk_error_log = rootpath + "logs/error_log"
 
+# -------------------------------------------------------------------
+# DNS QUERIES
+
+# Name servers used for the DNSBL queries
+dnsblk_nameservers = ["192.168.0.1"]
+
+# Seconds a DNSBL query may take, retries included, before it counts as not listed
+# (Default: 2 Seconds). It also bounds how long a shutdown waits for the running queries.
+dnsblk_dns_timeout = 2.0
+
+# Number of DNSBL queries made in parallel
+dnsblk_threads = 16
+
+# Maximum number of DNSBL queries sent per second (0 = no limit)
+dnsblk_max_qps = 1000
+
+# Seconds a "not listed" DNSBL result is reused before it is queried again
+# (Default: 5 Minutes). Listed results are reused for the TTL of the DNS answer.
+dnsblk_negative_ttl = 300
+
+# Stop checking an IP address once it is listed on this many servers (0 = check all servers)
+dnsblk_stop_after_hits = 0
+
 # -------------------------------------------------------------------
 # EMAIL ALERTS
 
+# Maximum number of IP addresses listed in an alert email (0 = no limit)
+# (all the listings are still written to the log file)
+dnsblk_mail_max_ips = 200
+
 # Email addresses of administrators which will receive the alert notifications
 dnsblk_recipients = ["your_email_address@your_domain.com"]
 
@@ -34,4 +61,7 @@ dnsblk_from = "postmaster@your_domain_com.com"
 dnsblk_smtp_host = "localhost"
 
 # Local SMTP Port
-dnsblk_smtp_port = 25
\ No newline at end of file
+dnsblk_smtp_port = 25
+
+# Seconds to wait for the SMTP server before giving up (Default: 1 Minute)
+dnsblk_smtp_timeout = 60
\ No newline at end of file
@@ -1,10 +1,58 @@
+import time
+import socket
+import threading
 import dns.resolver
 import dns.reversename
 
+_nameservers = ['192.168.0.1']
+_negative_ttl = 300
+_max_qps = 0
+_timeout = 2.0
+
+# The resolver instance shared by all the queries
+# (with a short lifetime, dnspython would otherwise wait up to 30 seconds per query)
+_resolver = dns.resolver.Resolver(configure=False)
+_resolver.nameservers = _nameservers
+_resolver.timeout = _resolver.lifetime = _timeout
+
+# The results of the previous queries: (reversed ip, server) => (expire time, result)
+# (the only cache: listed results expire with the DNS TTL, the others after _negative_ttl)
+_cache = {}
+
+# The token bucket limiting the queries per second: tokens left, last refill time
+_bucket_tokens = 0.0
+_bucket_time = time.time()
+_bucket_lock = threading.Lock()
+
+# The function used to Initialize this module
+def dnsbl_init(nameservers, negative_ttl, max_qps, timeout = 2.0):
+  global _nameservers, _negative_ttl, _max_qps, _timeout, _bucket_tokens, _bucket_time
+  
+  _nameservers = nameservers
+  _negative_ttl = negative_ttl
+  _max_qps = max_qps
+  _timeout = timeout
+  
+  _resolver.nameservers = _nameservers
+  _resolver.timeout = _resolver.lifetime = _timeout
+  _cache.clear()
+  
+  _bucket_tokens = float(_max_qps)
+  _bucket_time = time.time()
+
 
 # DNS resolver used to check if an IP is blacklisted or not
 def dnsbl(ip, server):
-  lst = [server]
+  revip = dnsbl_reverse(ip)
+  if revip is False:
+    return False
+  
+  return dnsbl_query(revip, server)
+
+
+# Reverse an IP address into the form used by the DNSBL queries
+# Returns False if the IP address is not valid
+def dnsbl_reverse(ip):
   
   # if IPv4
   if ip.find('.') > -1:
@@ -12,32 +60,61 @@ def dnsbl(ip, server):
     # check if there is an IPv4 mapped as IPv6
     ip = ip.replace('::ffff:', '')
   
-    # reverse IP
-    splits = ip.split('.')
-    splits.reverse()
-    revip  = '.'.join(splits)
+    # reverse IP (from its packed form, which also validates it)
+    try:
+      octets = bytearray(socket.inet_pton(socket.AF_INET, ip))
+    except socket.error:
+      return False
+    
+    revip = '%d.%d.%d.%d' % (octets[3], octets[2], octets[1], octets[0])
     
   else:
-    # it is IPv6 formatted
-    revip = dns.reversename.from_address(ip)
-    revip = '.'.join(revip[0:32])
+    # it is IPv6 formatted, reverse it without the reverse zone suffix
+    try:
+      name = dns.reversename.from_address(ip)
+    except Exception:
+      return False
+    
+    # an IPv4 mapped address (without dots) is reversed in the in-addr.arpa zone
+    if name.is_subdomain(dns.reversename.ipv6_reverse_domain):
+      name = name.relativize(dns.reversename.ipv6_reverse_domain)
+    elif name.is_subdomain(dns.reversename.ipv4_reverse_domain):
+      name = name.relativize(dns.reversename.ipv4_reverse_domain)
+    else:
+      return False
+    
+    revip = name.to_text()
+  
+  return revip
+
+
+# Query a DNSBL server for an already reversed IP address
+def dnsbl_query(revip, server):
+  key = (revip, server)
+  
+  # reuse the previous result while it did not expire
+  cached = _cache.get(key)
+  if cached is not None and cached[0] > time.time():
+    return cached[1]
+  
+  lst = [server]
   
   # prepare query
   suspip = revip + '.' + server
   
-  # instance
-  mkr = dns.resolver.Resolver()
-  mkr.nameservers = ['192.168.0.1']
-  
   # Please note that the answer is returned in the A record, not in the AAAA
   # http://www.spamhaus.org/organization/statement/012/spamhaus-ipv6-blocklists-strategy-statement
   
+  # respect the queries per second limit
+  _throttle()
+  
   try:
     try:
       # Make the DNS query
-      res = mkr.query(suspip, 'A')
+      res = _resolver.query(suspip, 'A')
     except dns.resolver.NXDOMAIN:
-      # Not Listed
+      # Not Listed (kept for the configured negative TTL)
+      _cache[key] = (time.time() + _negative_ttl, False)
       return False
     
     # Listed
@@ -45,8 +122,32 @@ def dnsbl(ip, server):
       lst.append(rdata.address) # A
     lst.append('R')
     
+    # kept for as long as the DNS answer is valid
+    _cache[key] = (time.time() + res.rrset.ttl, lst)
     return lst
   
   except:
-    # Not Listed
-    return False
\ No newline at end of file
+    # Not Listed (not cached, the error may be temporary)
+    return False
+
+
+# Wait until the token bucket allows one more query (no wait if there is no limit)
+def _throttle():
+  global _bucket_tokens, _bucket_time
+  
+  if not _max_qps:
+    return
+  
+  with _bucket_lock:
+    now = time.time()
+    
+    # refill the bucket, it holds at most one second worth of queries
+    _bucket_tokens = min(float(_max_qps), _bucket_tokens + (now - _bucket_time) * _max_qps)
+    _bucket_time = now
+    
+    # take a token, when the bucket is empty the wait pays back the missing one
+    _bucket_tokens -= 1
+    wait = -_bucket_tokens / _max_qps
+  
+  if wait > 0:
+    time.sleep(wait)
\ No newline at end of file
@@ -1,6 +1,10 @@
 import os
 import sys
 import time
+import Queue
+import threading
+import itertools
+import collections
 
 
 from config import *
@@ -9,69 +13,159 @@ from mail_lib import *
 from dnsbl_lib import *
 from file_handlers import *
 
-# A global variable used to check if shutdown was signaled
-shutdown = False
+# The DNSBL worker, it runs the queued checks until the queue is empty
+# (counts holds, for each IP address, the listings found so far and the checks running)
+def dnsblk_worker(tasks, hits, counts, counts_cond):
+  try:
+  
+    # check the shutdown flag before each check
+    while not shutdown_event.is_set():
+      try:
+        ip, revip, server = tasks.get_nowait()
+      except Queue.Empty:
+        break
+      
+      # with the stop after hits limit, no more checks run for an IP address
+      # than listings may still be needed to reach the limit
+      if dnsblk_stop_after_hits:
+        with counts_cond:
+          count = counts[ip]
+          
+          # skip the IP address once it is listed on enough servers
+          if count[0] >= dnsblk_stop_after_hits:
+            continue
+          
+          # put the check back at the end of the queue, it may not be needed,
+          # and wait for a running check to finish before the next one
+          if count[0] + count[1] >= dnsblk_stop_after_hits:
+            tasks.put((ip, revip, server))
+            counts_cond.wait(1)
+            continue
+          
+          count[1] += 1
+      
+      # Check the IP address against a DNSBL server
+      ret = dnsbl_query(revip, server)
+      
+      if dnsblk_stop_after_hits:
+        with counts_cond:
+          count = counts[ip]
+          count[1] -= 1
+          if ret is not False:
+            count[0] += 1
+          counts_cond.notify_all()
+      
+      # if the IP IS listed, keep it for the report
+      if ret is not False:
+        hits.append([timemark(), ip, server, ret[1]])
+  
+  except:
+    exc_type, exc_value, exc_traceback = sys.exc_info()
+    ret = except_catch(exc_type.__name__, exc_value, exc_traceback, threading.currentThread().getName())
+    if ret != False:
+      loggError(dnsblk_error_log, ret)
+
 
 # The main DNSBL Handler
 def dnsblk_handler(servers, ips):
   
   # check the shutdown flag
-  if shutdown == False:
+  if not shutdown_event.is_set():
     try:
       
-      # A dictionary used to store the listed IP addresses
-      listed_ips = {}
+      # A dictionary used to store the listed IP addresses (ip => servers)
+      listed_ips = collections.defaultdict(list)
       
       ###
       log_file_handler = None
-      csvwriter = None
       
-      # for each DNSBL server...
-      for server in servers:
-        
-        # check again the shutdown flag
-        if shutdown == True:
-          break
+      # A queue with a check for each IP address against each DNSBL server
+      tasks = Queue.Queue()
       
-        # for each IP address we want to query...
-        for ip in ips:
+      # for each IP address we want to query...
+      checks = []
+      for ip in ips:
         
-          # Check the IP address against a DNSBL server
-          ret = dnsbl(ip[0], server[0])
-          
-          # if the IP IS listed
-          if ret is not False:
-            if log_file_handler is None:
-              log_file_handler = open(dnsblk_log + str(int(time.time())) + ".log", 'wb')
-              csvwriter = csv.writer(log_file_handler, delimiter=',', quotechar='"', quoting=csv.QUOTE_ALL)
-              
-            csvwriter.writerow([time.strftime("%d %b %Y %H:%M:%S", time.gmtime()), ip[0], server[0], ret[1]])
-            log_file_handler.flush()
-            
-            # add the IP and the server in the previous defined dictionary
-            if ip[0] not in listed_ips:
-              listed_ips[ip[0]] = []
-            listed_ips[ip[0]].append(server[0])
-            
-          # sleep for a short time after each query
-          time.sleep(0.01)
+        # reverse the IP address once for all the servers
+        revip = dnsbl_reverse(ip[0])
+        if revip is False:
+          loggError(dnsblk_error_log, "Invalid IP address: " + ip[0])
+          continue
+        
+        checks.append((ip[0], revip))
+      
+      # for each DNSBL server...
+      # (the servers are the inner loop, so the load is spread among them; with
+      # the stop after hits limit the IP addresses are the inner loop instead,
+      # so the checks running at the same time belong to different IP addresses)
+      if dnsblk_stop_after_hits:
+        for server in servers:
+          for ip, revip in checks:
+            tasks.put((ip, revip, server[0]))
+      else:
+        for ip, revip in checks:
+          for server in servers:
+            tasks.put((ip, revip, server[0]))
+      
+      # The listed IP addresses found by the workers: [time, ip, server, answer]
+      hits = []
+      
+      # The listings found and the checks running for each IP address: ip => [found, running]
+      # (shared by the workers, used by the stop after hits limit)
+      counts = collections.defaultdict(lambda: [0, 0])
+      counts_cond = threading.Condition()
+      
+      # run the checks in parallel, the DNS queries spend their time waiting for the network
+      workers = []
+      for i in range(min(dnsblk_threads, tasks.qsize())):
+        worker = threading.Thread(target=dnsblk_worker, args=(tasks, hits, counts, counts_cond))
+        worker.daemon = True
+        worker.start()
+        workers.append(worker)
+      
+      # wait for the workers to finish
+      # (join with a timeout, so the signals are still handled while waiting)
+      for worker in workers:
+        while worker.isAlive():
+          worker.join(1)
+      
+      # for each listed IP address
+      for hit in hits:
+        if log_file_handler is None:
+          # use a large buffer, the rows are written to disk in blocks
+          log_file_handler = open(dnsblk_log + str(int(time.time())) + ".log", 'wb', 1 << 16)
           
+        # the values never hold quotes, so the fully quoted CSV row is built directly
+        log_file_handler.write('"' + '","'.join(hit) + '"\r\n')
+        
+        # add the IP and the server in the previous defined dictionary
+        listed_ips[hit[1]].append(hit[2])
+        
           
       if log_file_handler is not None:
         log_file_handler.close()
       
       # If there are listed IP addresses, notice each administrator by email
-      if len(listed_ips) > 0:
+      # (no point in composing the email when there is nobody to send it to,
+      # or when the cycle was cut short by the shutdown)
+      if len(listed_ips) > 0 and dnsblk_recipients and not shutdown_event.is_set():
         
-        # compose the email text
-        mail_text = ""
-        for x in listed_ips:
-          mail_text += x + ' ===> ' + ", ".join(listed_ips[x]) + "\r\n"
+        # compose the email text (one line per IP address, joined once)
+        # (only the first IP addresses are listed, the log file holds all of them)
+        shown_ips = listed_ips
+        if dnsblk_mail_max_ips:
+          shown_ips = itertools.islice(listed_ips, dnsblk_mail_max_ips)
         
-        # and send the email to each administrator
-        for recipient in dnsblk_recipients:
-          ret = mail_plain(recipient, dnsblk_from, "Dnsblchk ALERT", mail_text)
-          
+        mail_lines = [x + ' ===> ' + ", ".join(listed_ips[x]) + "\r\n" for x in shown_ips]
+        if len(mail_lines) < len(listed_ips):
+          mail_lines.append("... and " + str(len(listed_ips) - len(mail_lines)) + " more\r\n")
+        
+        mail_text = "".join(mail_lines)
+        
+        # and send the email to each administrator (over one connection)
+        results = mail_batch(dnsblk_recipients, dnsblk_from, "Dnsblchk ALERT", mail_text)
+        
+        for ret in results:
           if not ret[0]:
             loggError(dnsblk_error_log, "Mailer error: " + str(ret[1]))
 
@@ -81,6 +175,10 @@ def dnsblk_handler(servers, ips):
       ret = except_catch(exc_type.__name__, exc_value, exc_traceback)
       if ret != False:
         loggError(dnsblk_error_log, ret)
+      
+      # write out the rows still held in the buffer
+      if log_file_handler is not None and not log_file_handler.closed:
+        log_file_handler.close()
 
 
 
@@ -89,37 +187,33 @@ def dnsblk_handler(servers, ips):
 if __name__ == "__main__":
   
   # Initialize the mail module
-  mail_init(dnsblk_smtp_host, dnsblk_smtp_port)
+  mail_init(dnsblk_smtp_host, dnsblk_smtp_port, dnsblk_smtp_timeout)
+  
+  # Initialize the DNSBL module
+  dnsbl_init(dnsblk_nameservers, dnsblk_negative_ttl, dnsblk_max_qps, dnsblk_dns_timeout)
 
   # Load the DNSBL servers and the IP addresses which will be checked
-  servers = load_csv(dnsblk_servers)
-  ips     = load_csv(dnsblk_ips)
+  # (without duplicates, there is no point in querying twice; the rows are
+  # streamed from the files, so only the unique ones are kept in memory)
+  servers = unique_rows(iter_csv(dnsblk_servers))
+  ips     = unique_rows(iter_csv(dnsblk_ips))
 
   # Run forever (until shutdown will be fired)
   while True:
     
     # check the shutdown flag
-    if shutdown:
+    if shutdown_event.is_set():
       break
       
       
-    # a counter variable used below
-    wait_counter = 0
-  
     try:
       # Run the DNSBL checks
       dnsblk_handler(servers, ips)
       
       
-      # wait a number of hours
-      # the whole period of time is divided in small chunks of 10 seconds
-      # to allow us to check if the shutdown was fired
-      while wait_counter < (dnsblk_sleep * 60 * 60):
-        if shutdown:
-          break
-      
-        time.sleep(10)
-        wait_counter += 10
+      # wait a number of hours (stop right away if the shutdown is signaled)
+      if wait_for_shutdown(dnsblk_sleep * 60 * 60):
+        break
 
     except:
       exc_type, exc_value, exc_traceback = sys.exc_info()
@@ -2,27 +2,64 @@ import csv
 import time
     
     
+# The error log files are opened once and kept open: file name => file
+_error_logs = {}
+
+
 # The function which will append rows to the error log file
 def loggError(file_name, data):
-  with open(file_name, 'a') as error_log:
-    error_log.write(_timemark() + " - " + data + "\r\n")
-    error_log.flush()
+  error_log = _error_logs.get(file_name)
+  if error_log is None:
+    error_log = _error_logs[file_name] = open(file_name, 'a')
+  
+  error_log.write(timemark() + " - " + data + "\r\n")
+  error_log.flush()
     
 
 # This function will load all data from a CSV file 
 def load_csv(servers_file):
+  return list(iter_csv(servers_file))
+
+
+# This function will yield the rows of a CSV file one by one, without loading all of them
+def iter_csv(servers_file):
+
+  # read the file in large blocks
+  with open(servers_file, 'rb', 1 << 20) as csvfile:
+    csvreader = csv.reader(csvfile, delimiter=',', quotechar='"')
+    for row in csvreader:
+      yield row
+
+
+# This function will drop the empty rows and the rows with a repeated first column
+def unique_rows(rows):
+  seen = set()
   result = []
 
-  with open(servers_file, 'rb') as csvfile:
-   csvreader = csv.reader(csvfile, delimiter=',', quotechar='"')
-   for row in csvreader:
+  for row in rows:
+    if row and row[0] not in seen:
+      seen.add(row[0])
       result.append(row)
-      
-      
+
   return result
   
-# A small function used to format the Date
-def _timemark():
-  t = time.gmtime()
+# Wrap a function formatting a time (in whole seconds) into one formatting the current time
+# (formatted at most once per second, the result is reused within the second)
+def per_second(formatter):
+  # the last formatted time: [(second, text)]
+  last = [(None, "")]
+
+  def formatted():
+    now = int(time.time())
+
+    cached = last[0]
+    if cached[0] != now:
+      cached = last[0] = (now, formatter(now))
+
+    return cached[1]
+
+  return formatted
+
 
-  return time.strftime("%d %b %Y %H:%M:%S", t)
\ No newline at end of file
+# A small function used to format the Date (also used for the log rows)
+timemark = per_second(lambda now: time.strftime("%d %b %Y %H:%M:%S", time.gmtime(now)))
\ No newline at end of file
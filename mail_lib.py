@@ -1,51 +1,123 @@
+import os
+import socket
 import smtplib
-import string
-import random
+import binascii
 import time
 from email.utils import formatdate
 
 _smtp_host = 'localhost'
 _smtp_port = 25
+_smtp_timeout = 60
 
 # The function used to Initialize this module
-def mail_init(smtp_host, smtp_port):
-  global _smtp_host, _smtp_port
+def mail_init(smtp_host, smtp_port, smtp_timeout = 60):
+  global _smtp_host, _smtp_port, _smtp_timeout
   
   _smtp_host = smtp_host
   _smtp_port = smtp_port
+  _smtp_timeout = smtp_timeout
 
   
 
 # The send mail function
 def mail_plain(to_email, from_email, subject, message, to_name = "", from_name = ""):
-
-  # MIME header
-  headers = "MIME-Version: 1.0" + "\r\n"
-
-  # message ID header
-  from_address, from_domain = string.split(from_email, "@")
-  headers  += "Message-Id: " + str(time.time()) + "." + \
-  ("".join(random.choice("0123456789ABCDEF") for i in range(16))) + \
-  "@" + from_domain + "\r\n"
-  
-  # Date Header
-  headers += "Date: " + formatdate(timeval=None, localtime=False, usegmt=True) + "\r\n"
-
-  # required headers
-  headers += "From: " + from_name + " <" + from_email + ">\r\n"
-  headers += "To: " + to_name + " <" + to_email + ">\r\n"
-  headers += "Subject: " + subject + "\r\n"
-
-  # content header
-  headers += "Content-Type: text/plain; charset=UTF-8\r\n"
-  headers += "\r\n"
+  head, tail = _mail_headers(from_email, subject, from_name)
+  headers = _mail_id(from_email) + head + _mail_to(to_email, to_name) + tail
 
   # try to send
   try:
-    connection = smtplib.SMTP(_smtp_host, _smtp_port)
+    connection = _smtp_connect()
     connection.sendmail(from_email, [to_email], headers + message)
     return [True]
 
   # get exception
   except Exception, exc:
-    return [False, exc]
\ No newline at end of file
+    return [False, exc]
+
+
+# The send mail function for many recipients over a single SMTP connection
+# Returns one result per recipient, in the same order
+def mail_batch(to_emails, from_email, subject, message, from_name = ""):
+  results = []
+
+  # try to connect
+  try:
+    connection = _smtp_connect()
+  except Exception, exc:
+    return [[False, exc] for to_email in to_emails]
+
+  # the message is built once, only the Message-Id and To headers differ between recipients
+  head, tail = _mail_headers(from_email, subject, from_name)
+  body = tail + message
+
+  # try to send to each recipient
+  for to_email in to_emails:
+    try:
+      connection.sendmail(from_email, [to_email], _mail_id(from_email) + head + _mail_to(to_email, "") + body)
+      results.append([True])
+    except Exception, exc:
+      results.append([False, exc])
+
+  # close the connection, the messages are already sent
+  # (the alerts are hours apart, longer than any SMTP server keeps an idle client)
+  try:
+    connection.quit()
+  except Exception:
+    pass
+
+  return results
+
+
+# Open a connection to the SMTP server
+# (with a timeout, so a dead server or a dropped connection does not hang the alert)
+def _smtp_connect():
+  connection = smtplib.SMTP(_smtp_host, _smtp_port, timeout=_smtp_timeout)
+
+  # send each SMTP command right away instead of waiting on Nagle's algorithm
+  connection.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+  return connection
+
+
+# Build the Message-Id header, unique for each message
+def _mail_id(from_email):
+
+  # the domain part of the sender address
+  from_domain = from_email.rpartition("@")[2]
+
+  return "".join([
+    "Message-Id: ", str(time.time()), ".",
+    binascii.hexlify(os.urandom(8)).upper(),
+    "@", from_domain, "\r\n"
+  ])
+
+
+# Build the headers of a plain text message, except for the Message-Id and To headers
+# Returns [the headers before To, the headers after To]
+def _mail_headers(from_email, subject, from_name):
+
+  head = "".join([
+    # MIME header
+    "MIME-Version: 1.0\r\n",
+
+    # Date Header
+    "Date: ", formatdate(timeval=None, localtime=False, usegmt=True), "\r\n",
+
+    # required headers
+    "From: ", from_name, " <", from_email, ">\r\n"
+  ])
+
+  tail = "".join([
+    "Subject: ", subject, "\r\n",
+
+    # content header
+    "Content-Type: text/plain; charset=UTF-8\r\n",
+    "\r\n"
+  ])
+
+  return [head, tail]
+
+
+# Build the To header
+def _mail_to(to_email, to_name):
+  return "To: " + to_name + " <" + to_email + ">\r\n"
\ No newline at end of file
@@ -2,53 +2,107 @@
 import os
 import sys
 import time
+import fcntl
+import select
 import signal
 import string
-import __main__
 import traceback
 import threading
+import StringIO
 from email.utils import formatdate
+from file_handlers import per_second
+
+# The flag used to tell everybody that the shutdown was signaled
+shutdown_event = threading.Event()
+
+# The line closing each logged exception report
+_separator = "\n" + "-" * 30 + "\n\n"
+
+# The pipe the interpreter writes a byte to on every signal (both ends non-blocking)
+# (a wait on it cannot miss a signal landing just before the wait starts)
+_wakeup_read, _wakeup_write = os.pipe()
+for fd in (_wakeup_read, _wakeup_write):
+  fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+signal.set_wakeup_fd(_wakeup_write)
+
+# Wait until the shutdown is signaled or the timeout (in seconds) passes
+# Returns True if the shutdown was signaled
+def wait_for_shutdown(timeout):
+  # a single wait on the wakeup pipe until the wake up time: any signal makes
+  # the pipe readable, so the shutdown flag is checked right away
+  wake_time = time.time() + timeout
+  while not shutdown_event.is_set():
+    remaining = wake_time - time.time()
+    if remaining <= 0:
+      return False
+    
+    try:
+      ready = select.select([_wakeup_read], [], [], remaining)[0]
+    except select.error:
+      # interrupted by the signal, its handler already ran
+      continue
+    
+    # empty the pipe, the flag tells if the signal was a shutdown
+    if ready:
+      try:
+        os.read(_wakeup_read, 4096)
+      except OSError:
+        pass
+  
+  return True
+
 
 # capture Exceptions
 def except_catch(type, value, track, thread=None):
   ret = False
   if type != "SystemExit":
     # RFC822 error timestamp
-    report = "Error time: " + formatdate(timeval=None, localtime=False, usegmt=True) + "\n"
+    report = "Error time: " + _error_time() + "\n"
     
     # thread no if set
     if thread != "":
       report += "Exception in thread: " + str(thread) + "\n\n"
     
-    # get report
-    rawreport = traceback.format_exception(type, value, track)
-    report += "\n" . join(rawreport)
+    # get report (printed straight into the buffer, without a list of lines)
+    buf = StringIO.StringIO()
+    traceback.print_exception(type, value, track, None, buf)
+    report += buf.getvalue()
     
     # the string for logging
-    ret = ("%s\n" + "-" * 30 + "\n\n") % report
+    ret = report + _separator
   return ret
 sys.excepthook = except_catch
 
 
+# Format the RFC822 error time
+_error_time = per_second(lambda now: formatdate(timeval=now, localtime=False, usegmt=True))
+
+
 # capture KeyboardInterrupt
-def interrupt_catch(signal, frame):
-  print ""
-  os._exit(1)
+# (shut down like on the exit signal, so the log file is written and closed)
+def interrupt_catch(signum, frame):
+  # only the first ^C shuts down gracefully, a second one kills right away
+  signal.signal(signal.SIGINT, signal.SIG_DFL)
+  
+  # tell children to shut down
+  shutdown_event.set()
+  
+  # end the ^C line with a single write, without going through the stdout buffer
+  # (stdout may be closed when running in the background)
+  try:
+    os.write(1, "\n")
+  except OSError:
+    pass
 signal.signal(signal.SIGINT, interrupt_catch)
 
 
 # capture exit signal
-def exit_catch(signal, frame):
-  # tell children to shut down
-  __main__.shutdown = True
+# (the workers stop after their current check, the handler writes out what was
+# found so far and the main loop ends, so the process exits on its own)
+def exit_catch(signum, frame):
+  # only the first signal shuts down gracefully, a second one kills right away
+  signal.signal(signal.SIGTERM, signal.SIG_DFL)
   
-  # wait for everything to terminate
-  while True:
-    if threading.activeCount() == 1:
-      break
-    else:
-      time.sleep(2)
-  
-  # kill parent
-  os._exit(1)
+  # tell children to shut down
+  shutdown_event.set()
 signal.signal(signal.SIGTERM, exit_catch)